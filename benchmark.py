@@ -0,0 +1,387 @@
+"""图书馆后端性能基准测试
+
+用法示例：
+    python benchmark.py                                   # 默认 1k/100k/1M 三档
+    python benchmark.py --scales 1000 --repeat 20         # 只跑 1k 档
+    python benchmark.py --output new.json --compare old.json --threshold 0.2
+
+每一档规模都会在临时目录中生成合成的 books.csv / borrows.csv（中英文混合书名），
+随后在进程内通过 FastAPI TestClient 调用 test.py 中的接口并计时，
+最终结果以 JSON 写出，可与历史结果对比做回归检测。
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCALES = [1_000, 100_000, 1_000_000]
+
+BOOK_FIELDS = ["id", "title", "author", "total", "available", "isbn", "price"]
+BORROW_FIELDS = [
+    "id", "book_id", "borrower_phone", "borrower_name", "borrower_college",
+    "borrow_date", "due_date", "returned"
+]
+
+# 合成数据词库（中英文混合）
+ZH_WORDS = ["Python", "数据", "算法", "编程", "机器学习", "网络", "设计", "原理",
+            "实战", "入门", "高级", "系统", "分析", "图解", "深度"]
+EN_WORDS = ["Python", "Data", "Algorithms", "Programming", "Learning", "Networks",
+            "Design", "Principles", "Practice", "Guide", "Advanced", "Systems"]
+ZH_NAMES = ["张三", "李四", "王五", "赵六", "小小飞机", "邓圣城", "陈晨", "刘洋"]
+EN_NAMES = ["John Doe", "John DAMN", "John lily", "Alice Smith", "Bob Lee"]
+COLLEGES = ["计算机学院", "交运", "机械学院", "外国语学院", "经管学院"]
+
+
+# ================== 合成数据 ==================
+def make_isbn(rng: random.Random) -> str:
+    """生成校验位正确、带连字符的ISBN-13"""
+    body = "9787" + "".join(rng.choices("0123456789", k=8))
+    total = sum(int(ch) * (3 if i % 2 else 1) for i, ch in enumerate(body))
+    check = (10 - total % 10) % 10
+    return f"{body[:3]}-{body[3]}-{body[4:7]}-{body[7:]}-{check}"
+
+
+def make_title(rng: random.Random) -> str:
+    """中英文混合书名"""
+    kind = rng.random()
+    if kind < 0.4:
+        return "".join(rng.sample(ZH_WORDS, 3))
+    if kind < 0.7:
+        return " ".join(rng.sample(EN_WORDS, 3))
+    return rng.choice(ZH_WORDS) + " " + rng.choice(EN_WORDS) + rng.choice(ZH_WORDS)
+
+
+def generate_dataset(directory: str, rows: int, seed: int = 42) -> Dict[str, List[str]]:
+    """在目录中写出 books.csv / borrows.csv，返回供基准使用的样本键"""
+    rng = random.Random(seed)
+    book_ids = [f"{i:08x}" for i in range(rows)]
+    books_path = os.path.join(directory, "books.csv")
+    borrows_path = os.path.join(directory, "borrows.csv")
+    base_date = datetime(2025, 1, 1)
+
+    with open(books_path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(",".join(BOOK_FIELDS) + "\n")
+        for book_id in book_ids:
+            total = rng.randint(1, 10)
+            f.write(",".join([
+                book_id, make_title(rng),
+                rng.choice(ZH_NAMES + EN_NAMES), str(total),
+                str(total), make_isbn(rng), str(rng.randint(10, 120))
+            ]) + "\n")
+
+    phones = [f"139{i:08d}" for i in range(max(rows // 5, 1))]
+    with open(borrows_path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(",".join(BORROW_FIELDS) + "\n")
+        for i in range(rows):
+            borrow_date = base_date + timedelta(minutes=i)
+            f.write(",".join([
+                f"b{i:07x}", rng.choice(book_ids), rng.choice(phones),
+                rng.choice(ZH_NAMES), rng.choice(COLLEGES),
+                borrow_date.isoformat(),
+                (borrow_date + timedelta(days=14)).isoformat(),
+                "true" if rng.random() < 0.8 else "false"
+            ]) + "\n")
+
+    return {"book_ids": book_ids, "phones": phones}
+
+
+# ================== 计时工具 ==================
+def time_calls(fn: Callable[[int], None], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """重复执行并汇总耗时（毫秒）"""
+    for i in range(warmup):
+        fn(-1 - i)
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_ms": samples[0],
+        "max_ms": samples[-1],
+    }
+
+
+@contextmanager
+def working_directory(path: str):
+    """test.py 的仓储使用相对路径，需要切换当前目录"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def fresh_app_module():
+    """每档规模重新导入 test.py，使服务按当前目录的CSV初始化"""
+    sys.modules.pop("test", None)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module("test")
+
+
+# ================== API基准 ==================
+def bench_api(rows: int, repeat: int, seed: int) -> Dict[str, Dict]:
+    """在进程内对各接口计时"""
+    from fastapi.testclient import TestClient
+
+    results: Dict[str, Dict] = {}
+    with tempfile.TemporaryDirectory(prefix="library-bench-") as workdir:
+        start = time.perf_counter()
+        keys = generate_dataset(workdir, rows, seed)
+        results["generate"] = {"n": 1, "mean_ms": (time.perf_counter() - start) * 1000}
+
+        with working_directory(workdir):
+            start = time.perf_counter()
+            module = fresh_app_module()
+            with TestClient(module.app) as client:
+                results["startup"] = {"n": 1, "mean_ms": (time.perf_counter() - start) * 1000}
+                rng = random.Random(seed)
+                book_ids, phones = keys["book_ids"], keys["phones"]
+
+                def check(response, *allowed: int):
+                    if response.status_code not in (200,) + allowed:
+                        raise RuntimeError(f"{response.request.url}: "
+                                           f"{response.status_code} {response.text}")
+
+                def search(_):
+                    keyword = rng.choice(ZH_WORDS + EN_WORDS + ["不存在的书"])
+                    check(client.post("/search_books", json={"keyword": keyword}))
+
+                def book_detail(_):
+                    check(client.post("/book_detail", json={"book_id": rng.choice(book_ids)}))
+
+                def borrower_info(_):
+                    check(client.post("/borrower_info",
+                                      json={"borrower_phone": rng.choice(phones)}), 404)
+
+                def stats(_):
+                    check(client.post("/stats"))
+
+                # 借还使用独立手机号，保证可重复执行
+                loans: List[Dict[str, str]] = []
+
+                def borrow(i):
+                    payload = {
+                        "book_id": book_ids[i % len(book_ids)],
+                        "borrower_phone": f"188{seed:04d}{i + 1000:04d}",
+                        "borrower_name": "基准测试",
+                        "borrower_college": "Bench",
+                    }
+                    check(client.post("/borrow", json=payload))
+                    loans.append(payload)
+
+                def return_book(_):
+                    loan = loans.pop()
+                    check(client.post("/return_book", json={
+                        "book_id": loan["book_id"],
+                        "borrower_phone": loan["borrower_phone"],
+                    }))
+
+                results["search_books"] = time_calls(search, repeat)
+                results["book_detail"] = time_calls(book_detail, repeat)
+                results["borrower_info"] = time_calls(borrower_info, repeat)
+                results["stats"] = time_calls(stats, repeat)
+                results["borrow"] = time_calls(borrow, repeat)
+                results["return_book"] = time_calls(return_book, len(loans), warmup=0)
+    return results
+
+
+# ================== OCR基准 ==================
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+         "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+              "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def ean13_modules(code: str) -> str:
+    """EAN-13 条码的模块序列（1为黑条）"""
+    digits = [int(ch) for ch in code]
+    left = ""
+    for parity, digit in zip(EAN_PARITY[digits[0]], digits[1:7]):
+        pattern = EAN_L[digit]
+        if parity == "G":  # G码为R码的逆序
+            pattern = "".join("1" if bit == "0" else "0" for bit in pattern)[::-1]
+        left += pattern
+    right = "".join("".join("1" if bit == "0" else "0" for bit in EAN_L[d]) for d in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def render_fixtures(seed: int) -> Dict[str, bytes]:
+    """渲染封面/版权页/价格页样张（OpenCV 内置字体仅支持ASCII）"""
+    import cv2
+    import numpy as np
+
+    rng = random.Random(seed)
+    pages = {
+        "cover": ["PYTHON", "PROGRAMMING"],
+        "info": ["Author: John Doe", "ISBN " + make_isbn(rng), "Press 2025"],
+        "price": ["Price: 39.00", "CNY 39.00"],
+    }
+    fixtures = {}
+    for name, lines in pages.items():
+        img = np.full((800, 600, 3), 255, dtype=np.uint8)
+        for idx, line in enumerate(lines):
+            scale = 2.0 if name == "cover" and idx == 0 else 1.0
+            cv2.putText(img, line, (40, 120 + idx * 90), cv2.FONT_HERSHEY_SIMPLEX,
+                        scale, (0, 0, 0), 2, cv2.LINE_AA)
+        ok, buffer = cv2.imencode(".png", img)
+        if ok:
+            fixtures[name] = buffer.tobytes()
+
+    # 封底条码样张，用于计时ISBN条码快速通道
+    isbn = make_isbn(rng).replace("-", "")
+    modules = ean13_modules(isbn)
+    module_px, quiet = 4, 40
+    img = np.full((400, len(modules) * module_px + quiet * 2, 3), 255, dtype=np.uint8)
+    for idx, bit in enumerate(modules):
+        if bit == "1":
+            x = quiet + idx * module_px
+            img[80:320, x:x + module_px] = 0
+    # 过于锐利的合成条码检测器无法定位，轻微模糊以接近真实拍摄
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    ok, buffer = cv2.imencode(".png", img)
+    if ok:
+        fixtures["info_barcode"] = buffer.tobytes()
+    return fixtures
+
+
+def load_image_dir(directory: str) -> Dict[str, bytes]:
+    """读取外部样张目录，文件名前缀决定扫描类型（cover_*/info_*/price_*）"""
+    fixtures = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(directory, filename), "rb") as f:
+                fixtures[os.path.splitext(filename)[0]] = f.read()
+    return fixtures
+
+
+def bench_ocr(repeat: int, seed: int, image_dir: Optional[str]) -> Dict[str, Dict]:
+    """对 PaddleProcessor 的三种识别入口计时"""
+    from ocr_processor import ocr_processor
+
+    handlers = {
+        "cover": ocr_processor.extract_cover_info,
+        "info": ocr_processor.extract_printing_info,
+        "price": ocr_processor.extract_price,
+    }
+    fixtures = load_image_dir(image_dir) if image_dir else render_fixtures(seed)
+    results: Dict[str, Dict] = {}
+    with tempfile.TemporaryDirectory(prefix="library-ocr-") as workdir, \
+            working_directory(workdir):  # 调试文件写入临时目录
+        for name, image_bytes in fixtures.items():
+            handler = handlers.get(name.split("_")[0])
+            if handler is None:
+                continue
+            errors = []
+            expect_barcode = name == "info_barcode"
+
+            def run(i):
+                try:
+                    result = handler(image_bytes)
+                except ValueError as e:  # 识别失败仍计入耗时
+                    if i >= 0:  # 预热调用不计入
+                        errors.append(str(e))
+                    return
+                if expect_barcode and result.get("isbn_source") != "barcode":
+                    raise RuntimeError("条码样张未走条码快速通道，计时结果无效")
+
+            timing = time_calls(run, repeat)
+            timing["errors"] = len(errors)
+            results[f"ocr_{name}"] = timing
+    return results
+
+
+# ================== 结果对比 ==================
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """逐项对比平均耗时，返回超过阈值的回归项"""
+    regressions = []
+    for scale, ops in current["results"].items():
+        base_ops = baseline.get("results", {}).get(scale, {})
+        for op, timing in ops.items():
+            base = base_ops.get(op)
+            if not base or not base.get("mean_ms"):
+                continue
+            ratio = timing["mean_ms"] / base["mean_ms"]
+            marker = "REGRESSION" if ratio > 1 + threshold else ""
+            print(f"{scale:>10} {op:<16} {base['mean_ms']:>12.2f} -> "
+                  f"{timing['mean_ms']:>12.2f} ms  x{ratio:.2f} {marker}")
+            if marker:
+                regressions.append(f"{scale}/{op}")
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="图书馆后端性能基准")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="数据规模（行数），默认 1000 100000 1000000")
+    parser.add_argument("--repeat", type=int, default=10, help="每个操作的计时次数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，保证可复现")
+    parser.add_argument("--skip-ocr", action="store_true", help="跳过OCR计时")
+    parser.add_argument("--ocr-images", help="使用外部样张目录代替内置渲染样张")
+    parser.add_argument("--output", default="bench_results.json", help="结果JSON路径")
+    parser.add_argument("--compare", help="用于回归对比的历史结果JSON")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="平均耗时增长超过该比例视为回归")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    for rows in args.scales:
+        print(f"[bench] {rows} 行 ...", flush=True)
+        report["results"][str(rows)] = bench_api(rows, args.repeat, args.seed)
+    if not args.skip_ocr:
+        print("[bench] OCR ...", flush=True)
+        report["results"]["ocr"] = bench_ocr(args.repeat, args.seed, args.ocr_images)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] 结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"[bench] 发现 {len(regressions)} 项性能回归: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,25 @@ from paddleocr import PaddleOCR
 import re
 import cv2
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional
+import time
 from datetime import datetime  # 新增导入
+from metrics import ocr_stage_duration
 
 
+class _StageTimer:
+    """包装PaddleOCR内部的检测/识别器，记录各阶段耗时"""
+    def __init__(self, predictor, stage: str):
+        self._predictor = predictor
+        self._stage = stage
+
+    def __call__(self, *args, **kwargs):
+        with ocr_stage_duration.time(stage=self._stage):
+            return self._predictor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._predictor, name)
+
 
 class PaddleProcessor:
     def __init__(self):
@@ -18,6 +33,11 @@ class PaddleProcessor:
              
         )
         self.debug_file = "ocr_result.txt"
+        # 检测与识别分别计时（PaddleOCR.ocr 内部先检测再识别）
+        for attr, stage in (("text_detector", "detection"), ("text_recognizer", "recognition")):
+            if hasattr(self.ocr, attr):
+                setattr(self.ocr, attr, _StageTimer(getattr(self.ocr, attr), stage))
+        self.barcode_detector = self._create_barcode_detector()
     
     def extract_printing_info(self, image_bytes: bytes) -> dict:
         """印刷页信息结构化提取"""
@@ -85,14 +105,21 @@ class PaddleProcessor:
 
     def _preprocess(self, image_bytes: bytes) -> np.ndarray:
         """通用图像预处理"""
-        img_array = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        
-        # 自适应直方图均衡化
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        lab[...,0] = clahe.apply(lab[...,0])
-        img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return self._enhance(self._decode(image_bytes))
+
+    def _decode(self, image_bytes: bytes) -> np.ndarray:
+        """解码图片字节"""
+        with ocr_stage_duration.time(stage="decode"):
+            img_array = np.frombuffer(image_bytes, np.uint8)
+            return cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+
+    def _enhance(self, img: np.ndarray) -> np.ndarray:
+        """自适应直方图均衡化"""
+        with ocr_stage_duration.time(stage="clahe"):
+            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+            lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+            lab[...,0] = clahe.apply(lab[...,0])
+            img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
         
         return img
 
@@ -135,12 +162,18 @@ class PaddleProcessor:
         raise ValueError("无法识别书名")
 
     def extract_printing_info(self, image_bytes: bytes) -> dict:
-        """印刷页信息结构化提取"""
-        img = self._preprocess(image_bytes)
+        """印刷页信息结构化提取（优先识别EAN-13条码，失败再走OCR）"""
+        raw = self._decode(image_bytes)
+        isbn = self._decode_barcode_isbn(raw)
+        if isbn:
+            return {'author': None, 'isbn': isbn, 'isbn_source': 'barcode'}
+
+        img = self._enhance(raw)
         blocks = self._find_text_blocks(img)
         full_text = "\n".join([b[1][0] for b in blocks])
         
-        result = {'author': None, 'isbn': None}
+        result = {'author': None, 'isbn': None, 'isbn_source': 'ocr'}
+        regex_start = time.perf_counter()
         
         # 修改后的作者识别模式
         author_patterns = [
@@ -168,6 +201,7 @@ class PaddleProcessor:
             if self.validate_isbn(clean_isbn):
                 result['isbn'] = clean_isbn
                 break
+        ocr_stage_duration.observe(time.perf_counter() - regex_start, stage="regex")
         
         if not result['isbn']:
             raise ValueError("ISBN校验失败")
@@ -223,15 +257,16 @@ class PaddleProcessor:
                 r'(?:USD|CNY|EUR)\s*(\d+\.\d{2})'
             ]
 
-            for pattern in patterns:
-                if match := re.search(pattern, merged_text):
-                    try:
-                        price_str = match.group(1).replace(',', '')
-                        price = round(float(price_str), 2)
-                        if 0 < price < 10000:
-                            return price
-                    except (ValueError, TypeError):
-                        continue
+            with ocr_stage_duration.time(stage="regex"):
+                for pattern in patterns:
+                    if match := re.search(pattern, merged_text):
+                        try:
+                            price_str = match.group(1).replace(',', '')
+                            price = round(float(price_str), 2)
+                            if 0 < price < 10000:
+                                return price
+                        except (ValueError, TypeError):
+                            continue
 
             raise ValueError("未找到有效价格信息")
 
@@ -251,6 +286,36 @@ class PaddleProcessor:
             print(f"OCR处理异常: {str(e)}")
             return []
     @staticmethod
+    def _create_barcode_detector():
+        """OpenCV内置条码检测器（4.8起在主模块，旧版本需opencv-contrib）"""
+        barcode = getattr(cv2, "barcode", None)
+        if barcode is None or not hasattr(barcode, "BarcodeDetector"):
+            return None
+        try:
+            return barcode.BarcodeDetector()
+        except cv2.error:
+            return None
+
+    def _decode_barcode_isbn(self, img: Optional[np.ndarray]) -> Optional[str]:
+        """从条码中读取ISBN，未检测到或校验失败时返回None"""
+        if self.barcode_detector is None or img is None:
+            return None
+        with ocr_stage_duration.time(stage="barcode"):
+            try:
+                detector = self.barcode_detector
+                if hasattr(detector, "detectAndDecodeWithType"):  # OpenCV >= 4.8
+                    ok, decoded_info, _, _ = detector.detectAndDecodeWithType(img)
+                else:
+                    ok, decoded_info, _, _ = detector.detectAndDecode(img)
+            except cv2.error:
+                return None
+        for code in (decoded_info if ok else []):
+            code = code.strip()
+            if code.startswith(("978", "979")) and self.validate_isbn(code):
+                return code
+        return None
+
+    @staticmethod
     def validate_isbn(isbn: str) -> bool:
         """ISBN-13校验"""
         if len(isbn) != 13 or not isbn.isdigit():
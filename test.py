@@ -1,14 +1,29 @@
 from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 import csv
-from typing import Dict, List, Any, Optional
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional
 import os
 import random
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 from ocr_processor import ocr_processor
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from fastapi.middleware.cors import CORSMiddleware  # 跨域中间件
+import metrics
 
 
 # ================== 工具类 ==================
@@ -20,13 +35,164 @@ class IdGenerator:
         hex_ts = f"{timestamp:x}"[-4:]  # 取时间戳后4位十六进制
         return hex_ts + ''.join(random.choices("0123456789abcdef", k=size-4))
 
+    # 可排序ID：12位十六进制毫秒时间戳 + 8位单调计数（示例：0195a3c2e41f7c2d09b1）
+    SORTABLE_TS_LEN = 12
+    SORTABLE_LEN = 20
+    _lock = threading.Lock()
+    _last_ms = 0
+    _counter = 0
+
+    @classmethod
+    def new_sortable_id(cls) -> str:
+        """生成按时间单调递增、进程内不重复的ID（类ULID）"""
+        with cls._lock:
+            ms = max(int(time.time() * 1000), cls._last_ms)  # 时钟回拨时沿用上次时间
+            if ms == cls._last_ms:
+                cls._counter += 1
+                if cls._counter > 0xffffffff:  # 同一毫秒内计数溢出，借用下一毫秒
+                    ms += 1
+                    cls._counter = random.getrandbits(31)
+            else:
+                cls._counter = random.getrandbits(31)  # 预留一半空间供同毫秒递增
+            cls._last_ms = ms
+            return f"{ms:012x}{cls._counter:08x}"
+
+    @classmethod
+    def is_sortable(cls, item_id: str) -> bool:
+        """区分新格式ID与历史8位ID"""
+        if len(item_id) != cls.SORTABLE_LEN:
+            return False
+        try:
+            int(item_id, 16)
+        except ValueError:
+            return False
+        return True
+
+    @classmethod
+    def bound_for(cls, moment: datetime, upper: bool = False) -> str:
+        """某一时刻对应的ID边界，用于范围查询"""
+        ms = int(moment.timestamp() * 1000)
+        return f"{ms:012x}" + ("f" if upper else "0") * (cls.SORTABLE_LEN - cls.SORTABLE_TS_LEN)
+
+class ResponseCache:
+    """按数据版本缓存序列化后的响应（LRU淘汰）"""
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        """由响应内容生成ETag，多进程下相同数据得到相同ETag"""
+        return '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+
+    @staticmethod
+    def matches(if_none_match: Optional[str], etag: str) -> bool:
+        """解析If-None-Match（支持逗号分隔列表、W/弱校验与*）"""
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*":
+                return True
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, etag: str, body: bytes):
+        self.entries[key] = (etag, body)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+class FileLock:
+    """跨进程建议锁（同一进程内可重入，同一路径共用一个实例）"""
+    _instances: Dict[str, "FileLock"] = {}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    @classmethod
+    def for_path(cls, path: str) -> "FileLock":
+        key = os.path.abspath(path)
+        if key not in cls._instances:
+            cls._instances[key] = cls(key)
+        return cls._instances[key]
+
+    def __enter__(self):
+        self._local.acquire()
+        if self._depth == 0:
+            handle = None
+            try:
+                handle = open(self.path, 'a+')
+                if fcntl:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                else:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            except Exception:
+                if handle:
+                    handle.close()
+                self._local.release()
+                raise
+            self._handle = handle
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            self._handle.close()
+            self._handle = None
+        self._local.release()
+
 # ================== 数据访问层 ==================
+# 多进程协调模式：以 uvicorn --workers N 运行时设置 LIBRARY_MULTI_WORKER=1
+MULTI_WORKER = os.environ.get("LIBRARY_MULTI_WORKER") == "1"
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024  # 变更日志超过该大小后压缩
+
 class CSVRepository:
-    def __init__(self, filename: str, schema: Dict[str, type], pk_field: str = "id"):
+    def __init__(self, filename: str, schema: Dict[str, type], pk_field: str = "id",
+                 coordinated: bool = MULTI_WORKER,
+                 unique_indexes: Optional[Dict[str, Callable[[Any], Optional[str]]]] = None):
         self.filename = filename
         self.schema = schema
         self.pk_field = pk_field
         self.data: Dict[str, Dict] = {}
+        self.version = 0  # 数据版本号，任何变更单调递增
+        self.time_index: List[str] = []  # 新格式ID的有序列表，支持按创建时间范围查询
+        self.legacy_ids: set = set()  # 历史8位ID，无法从ID推算时间
+        # 唯一哈希索引：字段名 -> 规范化函数；索引内容为 规范化值 -> 主键
+        self.unique_indexes = unique_indexes or {}
+        self.indexes: Dict[str, Dict[str, str]] = {field: {} for field in self.unique_indexes}
+        self._file_signature = None  # 最近一次加载/写出时的文件状态
+        self.metric_name = os.path.splitext(os.path.basename(filename))[0]
+        metrics.repository_rows.set_function(lambda: len(self.data), repository=self.metric_name)
+
+        # 协调模式：写操作持有文件锁，变更追加到日志供其他进程增量同步
+        self.coordinated = coordinated
+        self.lock = FileLock.for_path(filename + ".lock") if coordinated else nullcontext()
+        self.journal_file = filename + ".changes"
+        self._journal_inode = None
+        self._journal_offset = 0
         
         # 自动创建CSV文件
         if not os.path.exists(filename):
@@ -35,7 +201,19 @@ class CSVRepository:
                 writer.writeheader()
 
     def load(self):
-        """加载CSV数据到内存"""
+        """加载CSV数据到内存（文件未变化时跳过，变化时整体替换以同步删除）"""
+        signature = self._stat_signature()
+        if signature == self._file_signature:
+            return
+        with self.lock:
+            self._load_csv()
+
+    def _load_csv(self):
+        """解析整个CSV；协调模式下同时记录日志位置（调用方需持有锁）"""
+        start = time.perf_counter()
+        signature = self._stat_signature()
+        self.data.clear()  # 内存数据写入即落盘，整体替换不会丢失本实例的变更
+        rows = 0
         with open(self.filename, 'r', encoding='utf-8-sig') as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -44,6 +222,128 @@ class CSVRepository:
                     for field in self.schema
                 }
                 self.data[processed[self.pk_field]] = processed
+                rows += 1
+        self.time_index = sorted(k for k in self.data if IdGenerator.is_sortable(k))
+        self.legacy_ids = {k for k in self.data if not IdGenerator.is_sortable(k)}
+        for field, normalize in self.unique_indexes.items():
+            index = self.indexes[field] = {}
+            for item_id, item in self.data.items():
+                key = normalize(item.get(field))
+                if key:
+                    index.setdefault(key, item_id)  # 历史重复数据保留最先出现的一条
+        self._file_signature = signature
+        if self.coordinated:
+            self._journal_inode, self._journal_offset = self._journal_stat()
+        self.version += 1
+        self._observe("load", start, rows)
+
+    def refresh(self):
+        """同步其他进程（或同进程其他实例）写入的变更"""
+        if not self.coordinated:
+            self.load()
+            return
+        inode, size = self._journal_stat()
+        if inode != self._journal_inode or size < self._journal_offset:
+            # 日志已被压缩或尚未加载过：全量重载
+            with self.lock:
+                self._load_csv()
+        elif size > self._journal_offset:
+            self._apply_journal()
+
+    @contextmanager
+    def transaction(self):
+        """写事务：持锁并先同步最新数据，保证写回时不覆盖他人变更"""
+        with self.lock:
+            self.refresh()  # 单进程模式下即按文件状态检查的load()，同进程其他实例的写入也能同步
+            yield self
+
+    def compare_and_set(self, item_id: str, field: str, expected: Any, new: Any) -> bool:
+        """字段当前值等于expected时才更新为new，否则返回False"""
+        with self.transaction():
+            item = self.data.get(item_id)
+            if item is None or item.get(field) != expected:
+                return False
+            self.save({**item, field: new})
+            return True
+
+    def increment(self, item_id: str, **deltas: int) -> Optional[Dict]:
+        """在事务内基于最新数据累加数值字段，只改动指定字段"""
+        with self.transaction():
+            item = self.data.get(item_id)
+            if item is None:
+                return None
+            self.save({**item, **{field: (item.get(field) or 0) + delta
+                                  for field, delta in deltas.items()}})
+            return self.data[item_id]
+
+    # 同进程内每个文件的写入次数；mtime精度有限，同一时刻写入等长内容时仍能区分
+    _write_counts: Dict[str, int] = {}
+
+    def _stat_signature(self) -> tuple:
+        """文件修改时间与大小，用于判断磁盘数据是否被改动"""
+        stat = os.stat(self.filename)
+        writes = CSVRepository._write_counts.get(os.path.abspath(self.filename), 0)
+        return (writes, stat.st_mtime_ns, stat.st_size)
+
+    def _journal_stat(self) -> tuple:
+        try:
+            stat = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return (None, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def _apply_journal(self):
+        """读取日志新增部分并应用到内存（只处理完整的行）"""
+        start = time.perf_counter()
+        with open(self.journal_file, 'rb') as f:
+            f.seek(self._journal_offset)
+            chunk = f.read()
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        entries = complete.splitlines()
+        for line in entries:
+            entry = json.loads(line)
+            if entry["op"] == "put":
+                row = entry["row"]
+                self._put({
+                    field: self._parse_value(field, row.get(field, ""))
+                    for field in self.schema
+                })
+            elif entry["op"] == "del":
+                self._drop(entry["id"])
+        self._journal_offset += len(complete)
+        if entries:
+            self.version += 1
+        self._observe("refresh", start, len(entries))
+
+    def _journal(self, op: str, items: List[Dict]):
+        """追加变更日志（调用方需持有锁），过大时压缩"""
+        if not self.coordinated:
+            return
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            for item in items:
+                if op == "del":
+                    entry = {"op": op, "id": item[self.pk_field]}
+                else:
+                    entry = {"op": op, "row": {
+                        field: self._serialize(field, item.get(field))
+                        for field in self.schema
+                    }}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        inode, size = self._journal_stat()
+        if size > JOURNAL_MAX_BYTES:
+            # CSV已包含全部变更，换一个空日志；其他进程发现inode变化后全量重载
+            tmp = self.journal_file + ".tmp"
+            open(tmp, 'w').close()
+            os.replace(tmp, self.journal_file)
+            inode, size = self._journal_stat()
+        self._journal_inode, self._journal_offset = inode, size
+
+    def _observe(self, op: str, start: float, rows: int):
+        """记录仓储操作耗时与扫描行数"""
+        metrics.repository_op_duration.observe(
+            time.perf_counter() - start, repository=self.metric_name, op=op
+        )
+        metrics.repository_rows_scanned.inc(rows, repository=self.metric_name, op=op)
 
     def _parse_value(self, field: str, value: str) -> Any:
         """类型转换处理器"""
@@ -62,25 +362,110 @@ class CSVRepository:
 
     def save(self, item: Dict) -> str:
         """保存单个记录"""
-        if not item.get(self.pk_field):
-            item[self.pk_field] = IdGenerator.new_hex_id()
-            
-        self.data[item[self.pk_field]] = item
-        self._persist()
+        with self.transaction():
+            if not item.get(self.pk_field):
+                item[self.pk_field] = self._new_id()
+                
+            self._put(item)
+            self.version += 1
+            self._persist()
+            self._journal("put", [item])
         return item[self.pk_field]
 
+    def save_many(self, items: List[Dict]) -> List[str]:
+        """批量保存记录（只写一次文件）"""
+        with self.transaction():
+            for item in items:
+                if not item.get(self.pk_field):
+                    item[self.pk_field] = self._new_id()
+                self._put(item)
+            if items:
+                self.version += 1
+                self._persist()
+                self._journal("put", items)
+        return [item[self.pk_field] for item in items]
+
+    def _new_id(self) -> str:
+        """生成新主键，确保不会覆盖已有记录"""
+        item_id = IdGenerator.new_sortable_id()
+        while item_id in self.data:
+            item_id = IdGenerator.new_sortable_id()
+        return item_id
+
+    def _put(self, item: Dict):
+        """写入内存并维护时间索引与唯一索引"""
+        item_id = item[self.pk_field]
+        previous = self.data.get(item_id)
+        if previous is None:
+            if IdGenerator.is_sortable(item_id):
+                insort(self.time_index, item_id)  # ID单调递增，通常直接追加到末尾
+            else:
+                self.legacy_ids.add(item_id)
+        else:
+            self._unindex(previous)
+        self.data[item_id] = item
+        for field, normalize in self.unique_indexes.items():
+            key = normalize(item.get(field))
+            if key:
+                self.indexes[field].setdefault(key, item_id)
+
+    def _unindex(self, item: Dict):
+        item_id = item[self.pk_field]
+        for field, normalize in self.unique_indexes.items():
+            key = normalize(item.get(field))
+            if key and self.indexes[field].get(key) == item_id:
+                del self.indexes[field][key]
+
+    def get_by(self, field: str, value: Any) -> Optional[Dict]:
+        """通过唯一索引查找记录（O(1)）"""
+        key = self.unique_indexes[field](value)
+        item_id = self.indexes[field].get(key) if key else None
+        return self.data.get(item_id) if item_id else None
+
+    def _drop(self, item_id: str) -> Optional[Dict]:
+        """从内存和索引中移除记录"""
+        item = self.data.pop(item_id, None)
+        if item is None:
+            return None
+        self._unindex(item)
+        if IdGenerator.is_sortable(item_id):
+            index = bisect_left(self.time_index, item_id)
+            if index < len(self.time_index) and self.time_index[index] == item_id:
+                del self.time_index[index]
+        else:
+            self.legacy_ids.discard(item_id)
+        return item
+
+    def find_created_between(self, start: datetime, end: datetime,
+                             date_field: Optional[str] = None) -> List[Dict]:
+        """按创建时间范围查询：新格式ID走有序索引，历史ID按date_field回退扫描"""
+        lo = bisect_left(self.time_index, IdGenerator.bound_for(start))
+        hi = bisect_right(self.time_index, IdGenerator.bound_for(end, upper=True))
+        result = [self.data[item_id] for item_id in self.time_index[lo:hi]]
+        if date_field:
+            legacy = (self.data[item_id] for item_id in self.legacy_ids)
+            result.extend(
+                item for item in legacy
+                if item.get(date_field) and start <= item[date_field] <= end
+            )
+        return result
+
     def delete(self, item_id: str) -> bool:
         """删除记录"""
-        if item_id in self.data:
-            del self.data[item_id]
+        with self.transaction():
+            item = self._drop(item_id)
+            if item is None:
+                return False
+            self.version += 1
             self._persist()
+            self._journal("del", [item])
             return True
-        return False
 
     def find(self, **filters: Any) -> List[Dict]:
 
         """条件查询"""
-        return [
+        start = time.perf_counter()
+        result = [
         item 
         for item in self.data.values()
         if all(
@@ -88,16 +473,36 @@ class CSVRepository:
             for k, v in filters.items()
         )
     ]
+        self._observe("find", start, len(self.data))
+        return result
+
     def _persist(self):
-        """持久化到CSV"""
-        with open(self.filename, 'w', encoding='utf-8-sig', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=self.schema.keys())
-            writer.writeheader()
-            for item in self.data.values():
-                writer.writerow({
-                    field: self._serialize(field, value)
-                    for field, value in item.items()
-                })
+        """持久化到CSV（先写临时文件再替换，读者不会看到写了一半的文件）"""
+        start = time.perf_counter()
+        # 临时文件名唯一，未加锁的多个进程同时写入也不会互相删掉对方的临时文件
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        prefix = os.path.splitext(os.path.basename(self.filename))[0] + "."
+        fd, tmp = tempfile.mkstemp(prefix=prefix, suffix=".csv.tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.schema.keys())
+                writer.writeheader()
+                for item in self.data.values():
+                    writer.writerow({
+                        field: self._serialize(field, value)
+                        for field, value in item.items()
+                    })
+            if os.path.exists(self.filename):
+                os.chmod(tmp, os.stat(self.filename).st_mode & 0o777)  # mkstemp默认0600，保持原权限
+            os.replace(tmp, self.filename)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        key = os.path.abspath(self.filename)
+        CSVRepository._write_counts[key] = CSVRepository._write_counts.get(key, 0) + 1
+        self._file_signature = self._stat_signature()
+        self._observe("persist", start, len(self.data))
 
     def _serialize(self, field: str, value: Any) -> str:
         """序列化处理"""
@@ -122,17 +527,18 @@ class BookService:
                 "available": int,
                 "isbn": str,  # 新增字段
                 "price": float  # 新增字段
-            }
+            },
+            unique_indexes={"isbn": self.normalize_isbn}
         )
         self.book_repo.load()
     def search_books(self, keyword: str, page: int, page_size: int) -> dict:
         """分页搜索书籍"""
-        self.book_repo.load() 
+        self.book_repo.refresh()
         all_books = list(self.book_repo.data.values())
         filtered = [
             book for book in all_books
-            if keyword.lower() in book["title"].lower() or 
-               keyword.lower() in book["author"].lower()
+            if keyword.lower() in (book["title"] or "").lower() or 
+               keyword.lower() in (book["author"] or "").lower()
         ]
         start = (page - 1) * page_size
         end = start + page_size
@@ -148,14 +554,39 @@ class BookService:
         return self.book_repo.delete(book_id)
       
     def create_book(self, book_data: Dict) -> str:
-        """创建新书（增加ISBN校验）"""
-        if "isbn" in book_data and not self._validate_isbn(book_data["isbn"]):
-            raise ValueError("无效的ISBN号码")
-            
-        return self.book_repo.save({
-            **book_data,
-            "available": book_data.get("total", 1)
-            })
+        """创建新书（增加ISBN校验）；ISBN已存在时合并为增加馆藏数量"""
+        if book_data.get("isbn"):
+            isbn = self.normalize_isbn(book_data["isbn"])
+            if not self._validate_isbn(isbn):
+                raise ValueError("无效的ISBN号码")
+            book_data = {**book_data, "isbn": isbn}
+
+        copies = book_data.get("total", 1)
+        with self.book_repo.transaction():
+            existing = self.book_repo.get_by("isbn", book_data.get("isbn"))
+            if existing:
+                # 只累加馆藏数量，不用可能过期的整行覆盖（借阅可能经由另一实例发生）
+                self.book_repo.increment(existing["id"], total=copies, available=copies)
+                return existing["id"]
+            return self.book_repo.save({
+                **book_data,
+                "available": copies
+                })
+
+    def find_by_isbn(self, isbn: str) -> Optional[dict]:
+        """按ISBN查找图书"""
+        self.book_repo.refresh()
+        return self.book_repo.get_by("isbn", isbn)
+
+    @staticmethod
+    def normalize_isbn(isbn: Optional[str]) -> Optional[str]:
+        """ISBN规范化：去掉序号前缀（如"1. "）、ISBN字样、连字符与空格"""
+        if not isbn:
+            return None
+        value = re.sub(r'^\s*\d+\.\s+', '', str(isbn))
+        value = re.sub(r'(?i)^\s*(ISBN|标准书号)[-:：\s]*', '', value)
+        value = re.sub(r'[^0-9Xx]', '', value).upper()
+        return value or None
            
 
     @staticmethod
@@ -170,6 +601,19 @@ class BookService:
         """获取图书详情"""
         return self.book_repo.data.get(book_id)
 
+    def adjust_available(self, book_id: str, delta: int) -> dict:
+        """以比较并交换方式调整库存，并发写入时重试而不丢失更新"""
+        while True:
+            self.book_repo.refresh()
+            book = self.get_book(book_id)
+            if not book:
+                raise ValueError("书籍不存在")
+            current = book["available"]
+            if current + delta < 0:
+                raise ValueError("图书不可借阅")
+            if self.book_repo.compare_and_set(book_id, "available", current, current + delta):
+                return self.get_book(book_id)
+
 
     
 
@@ -193,6 +637,7 @@ class BorrowService:
 
     def get_borrower_info(self, phone: str) -> dict:
         """获取借阅人详细信息"""
+        self.borrow_repo.refresh()
         records = self.borrow_repo.find(
             borrower_phone=phone,
             returned=False
@@ -219,35 +664,42 @@ class BorrowService:
     
     def create_borrow_record(self, borrow_data: Dict) -> str:
         """创建借阅记录"""
-        if not borrow_data.get("id"):
-            borrow_data["id"] = IdGenerator.new_hex_id()
         return self.borrow_repo.save(borrow_data)
 
     def return_book(self, book_id: str, borrower_phone: str) -> dict:
         """归还图书"""
-        # 查找未归还记录
-        records = self.borrow_repo.find(
-            book_id=book_id,
-            borrower_phone=borrower_phone,
-            returned=False
-        )
-        
-        if not records:
-            raise ValueError("未找到借阅记录")
-        
-        # 更新借阅记录
-        record = records[0]
-        record["returned"] = True
-        self.borrow_repo.save(record)
-        
-        # 恢复库存
-        book = self.book_service.get_book(book_id)
-        if book:
-            book["available"] += 1
-            self.book_service.book_repo.save(book)
+        with self.borrow_repo.transaction():
+            # 查找未归还记录
+            records = self.borrow_repo.find(
+                book_id=book_id,
+                borrower_phone=borrower_phone,
+                returned=False
+            )
+            
+            if not records:
+                raise ValueError("未找到借阅记录")
+            
+            # 更新借阅记录
+            record = records[0]
+            record["returned"] = True
+            self.borrow_repo.save(record)
+            
+            # 恢复库存
+            if self.book_service.get_book(book_id):
+                self.book_service.adjust_available(book_id, 1)
             
         return {"message": "归还成功"}
     
+    def get_borrows_between(self, start: datetime, end: datetime) -> list:
+        """查询时间段内创建的借阅记录"""
+        self.borrow_repo.refresh()
+        # 借阅日期以本地时间（无时区）存储，带时区的参数先转换
+        start, end = (
+            moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+            for moment in (start, end)
+        )
+        return self.borrow_repo.find_created_between(start, end, date_field="borrow_date")
+
     def get_borrow_history(self, borrower_phone: str) -> list:
         """获取用户借阅历史"""
         return self.borrow_repo.find(borrower_phone=borrower_phone)
@@ -292,40 +744,116 @@ class BorrowService:
     def borrow_book(self, borrow_data: Dict) -> Dict:
         """借阅操作"""
 
-        self.book_service.book_repo.load() 
-        book = self.book_service.get_book(borrow_data["book_id"])
-        if not book or book["available"] <= 0:
-            raise ValueError("图书不可借阅")
-        existing = any(
-            record for record in self.borrow_repo.find(
-                book_id=borrow_data["book_id"],
-                borrower_phone=borrow_data["borrower_phone"],
-                returned=False
+        with self.borrow_repo.transaction():
+            self.book_service.book_repo.refresh()
+            book = self.book_service.get_book(borrow_data["book_id"])
+            if not book or book["available"] <= 0:
+                raise ValueError("图书不可借阅")
+            existing = any(
+                record for record in self.borrow_repo.find(
+                    book_id=borrow_data["book_id"],
+                    borrower_phone=borrow_data["borrower_phone"],
+                    returned=False
+                )
             )
-        )
-        if existing:
-            raise ValueError("同一手机号不可重复借阅")
-
-        # 更新图书库存
-        book["available"] -= 1
-        self.book_service.book_repo.save(book)
-        self.book_service.book_repo._persist() 
-
-
-        # 创建借阅记录
-        new_record = {
-        "book_id": borrow_data["book_id"],
-        "borrower_phone": borrow_data["borrower_phone"],
-        "borrower_name": borrow_data["borrower_name"],
-        "borrower_college": borrow_data["borrower_college"],
-        "borrow_date": datetime.now(),
-        "due_date": datetime.now() + timedelta(days=14),
-        "returned": False
-    }
-        self.borrow_repo.save(new_record)
-        self.borrow_repo._persist()
+            if existing:
+                raise ValueError("同一手机号不可重复借阅")
+
+            # 更新图书库存（比较并交换，库存不足或图书不存在时抛出）
+            try:
+                self.book_service.adjust_available(borrow_data["book_id"], -1)
+            except ValueError:
+                raise ValueError("图书不可借阅")
+
+            # 创建借阅记录
+            new_record = {
+            "book_id": borrow_data["book_id"],
+            "borrower_phone": borrow_data["borrower_phone"],
+            "borrower_name": borrow_data["borrower_name"],
+            "borrower_college": borrow_data["borrower_college"],
+            "borrow_date": datetime.now(),
+            "due_date": datetime.now() + timedelta(days=14),
+            "returned": False
+        }
+            self.borrow_repo.save(new_record)
         return {"message": "借阅成功"}
 
+    def borrow_books(self, borrow_data: Dict) -> Dict:
+        """批量借阅：一次校验全部图书，校验通过后每个仓储只写一次"""
+        book_ids = borrow_data["book_ids"]
+        if not book_ids:
+            raise ValueError("未选择图书")
+        if len(set(book_ids)) != len(book_ids):
+            raise ValueError("借阅列表中存在重复图书")
+
+        # 两个仓储均持锁（顺序与单本借阅一致：先借阅记录后图书），整批原子生效
+        with self.borrow_repo.transaction(), self.book_service.book_repo.transaction():
+            self.book_service.book_repo.refresh()  # 先同步其他实例写入的图书数据，避免写回旧副本
+            active = {
+                record["book_id"] for record in self.borrow_repo.find(
+                    borrower_phone=borrow_data["borrower_phone"],
+                    returned=False
+                )
+            }
+            books = []
+            for book_id in book_ids:
+                book = self.book_service.get_book(book_id)
+                if not book or book["available"] <= 0:
+                    raise ValueError(f"图书不可借阅: {book_id}")
+                if book_id in active:
+                    raise ValueError(f"同一手机号不可重复借阅: {book_id}")
+                books.append(book)
+
+            # 全部校验通过后再修改内存数据
+            now = datetime.now()
+            for book in books:
+                book["available"] -= 1
+            self.book_service.book_repo.save_many(books)
+            self.borrow_repo.save_many([
+                {
+                    "book_id": book_id,
+                    "borrower_phone": borrow_data["borrower_phone"],
+                    "borrower_name": borrow_data["borrower_name"],
+                    "borrower_college": borrow_data["borrower_college"],
+                    "borrow_date": now,
+                    "due_date": now + timedelta(days=14),
+                    "returned": False
+                }
+                for book_id in book_ids
+            ])
+        return {"message": "借阅成功", "count": len(book_ids)}
+
+    def return_books(self, book_ids: List[str], borrower_phone: str) -> Dict:
+        """批量归还：一次查询借阅记录，每个仓储只写一次"""
+        if not book_ids:
+            raise ValueError("未选择图书")
+        with self.borrow_repo.transaction(), self.book_service.book_repo.transaction():
+            self.book_service.book_repo.refresh()  # 先同步其他实例写入的图书数据，避免写回旧副本
+            active = {
+                record["book_id"]: record for record in self.borrow_repo.find(
+                    borrower_phone=borrower_phone,
+                    returned=False
+                )
+            }
+            missing = [book_id for book_id in book_ids if book_id not in active]
+            if missing:
+                raise ValueError(f"未找到借阅记录: {', '.join(missing)}")
+
+            records = [active[book_id] for book_id in dict.fromkeys(book_ids)]
+            for record in records:
+                record["returned"] = True
+            self.borrow_repo.save_many(records)
+
+            # 恢复库存
+            books = []
+            for record in records:
+                book = self.book_service.get_book(record["book_id"])
+                if book:
+                    book["available"] += 1
+                    books.append(book)
+            self.book_service.book_repo.save_many(books)
+        return {"message": "归还成功", "count": len(records)}
+
 # ================== API层 ==================
 
 book_service = BookService()
@@ -337,9 +865,10 @@ async def lifespan(app: FastAPI):
     book_service.book_repo.load()
     borrow_service.borrow_repo.load()
     yield
-    # 退出时自动保存
-    book_service.book_repo._persist()
-    borrow_service.borrow_repo._persist()
+    # 退出时自动保存（事务内先同步，避免覆盖其他进程的写入）
+    for repo in (book_service.book_repo, borrow_service.borrow_repo):
+        with repo.transaction():
+            repo._persist()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -348,12 +877,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有方法 (GET/POST等)
     allow_headers=["*"],   # 允许所有请求头
+    expose_headers=["ETag"],  # 前端需读取ETag以发起条件请求
 )
 # 全局 OPTIONS 处理器
 @app.options("/{path:path}")
 async def options_handler():
     return {"message": "CORS preflight accepted"}
 
+# 请求耗时统计中间件（按路由模板聚合，避免路径参数导致标签膨胀）
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.http_request_duration.observe(
+            time.perf_counter() - start,
+            route=getattr(route, "path", "unmatched"),
+            method=request.method,
+            status=str(status)
+        )
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# 只读接口的响应缓存：键包含仓储版本号，数据变更后旧条目自然失效
+response_cache = ResponseCache()
+metrics.cache_entries.set_function(lambda: len(response_cache), cache="responses")
+
+def cached_response(http_request: Request, key: tuple, repos: List[CSVRepository], compute) -> Response:
+    """返回带ETag的缓存响应；If-None-Match命中时返回304"""
+    for repo in repos:
+        repo.refresh()
+    # 缓存按仓储版本查找；ETag取自响应内容，跨进程一致
+    cache_key = (key, tuple(repo.version for repo in repos))
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        body = json.dumps(jsonable_encoder(compute()), ensure_ascii=False).encode("utf-8")
+        entry = (ResponseCache.etag(body), body)
+        response_cache.put(cache_key, *entry)
+    etag, body = entry
+    if ResponseCache.matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
 # 数据模型
 class BookCreate(BaseModel):
     title: str
@@ -391,6 +963,20 @@ class ReturnRequest(BaseModel):
     book_id: str
     borrower_phone: str
 
+class BatchBorrowRequest(BaseModel):
+    book_ids: List[str]
+    borrower_phone: str
+    borrower_name: str
+    borrower_college: str
+
+class BatchReturnRequest(BaseModel):
+    book_ids: List[str]
+    borrower_phone: str
+
+class BorrowRangeRequest(BaseModel):
+    start: datetime
+    end: datetime
+
 class BookResponse(BookCreate):
     id: str
     available: int
@@ -404,6 +990,13 @@ async def create_book(book: BookCreate):
     except Exception as e:
         raise HTTPException(400, str(e))
     
+@app.get("/isbn/{isbn}")
+async def get_book_by_isbn(isbn: str):
+    book = book_service.find_by_isbn(isbn)
+    if not book:
+        raise HTTPException(404, "Book not found")
+    return book
+    
 @app.post("/borrower_info")
 async def get_borrower_info(request: BorrowerLoansRequest):
     try:
@@ -411,6 +1004,8 @@ async def get_borrower_info(request: BorrowerLoansRequest):
         if not info:
             raise HTTPException(status_code=404, detail="用户不存在或无借阅记录")
         return info
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -423,28 +1018,37 @@ async def borrow_book(request: BorrowRequest):
         raise HTTPException(400, str(e))
 
 @app.post("/search_books")
-async def search_books(request: SearchRequest):
+async def search_books(request: SearchRequest, http_request: Request):
     try:
-        result = book_service.search_books(
-            keyword=request.keyword,
-            page=request.page,
-            page_size=request.page_size
+        return cached_response(
+            http_request,
+            ("search_books", request.keyword, request.page, request.page_size),
+            [book_service.book_repo],
+            lambda: book_service.search_books(
+                keyword=request.keyword,
+                page=request.page,
+                page_size=request.page_size
+            )
         )
-        return result
     except Exception as e:
         raise HTTPException(500, str(e))
 
 @app.post("/book_detail")
-async def book_detail(request: BookDetailRequest):
+async def book_detail(request: BookDetailRequest, http_request: Request):
     try:
-        stats = borrow_service.calculate_book_stats(request.book_id)
-        return stats
+        return cached_response(
+            http_request,
+            ("book_detail", request.book_id, datetime.now().date()),  # 剩余天数按日变化
+            [borrow_service.book_service.book_repo, borrow_service.borrow_repo],
+            lambda: borrow_service.calculate_book_stats(request.book_id)
+        )
     except ValueError as e:
         raise HTTPException(404, str(e))
 
 @app.post("/borrower_loans")
 async def borrower_loans(request: BorrowerLoansRequest):
     try:
+        borrow_service.borrow_repo.refresh()
         records = borrow_service.borrow_repo.find(
             borrower_phone=request.borrower_phone,
             returned=False
@@ -463,19 +1067,43 @@ async def return_book(request: ReturnRequest):
     except ValueError as e:
         raise HTTPException(400, str(e))
 
+@app.post("/batch_borrow")
+async def batch_borrow(request: BatchBorrowRequest):
+    try:
+        return borrow_service.borrow_books(request.dict())
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/batch_return")
+async def batch_return(request: BatchReturnRequest):
+    try:
+        return borrow_service.return_books(
+            book_ids=request.book_ids,
+            borrower_phone=request.borrower_phone
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/borrows_between")
+async def borrows_between(request: BorrowRangeRequest):
+    records = borrow_service.get_borrows_between(request.start, request.end)
+    return {"data": records, "total": len(records)}
+
 class SystemStats(BaseModel):
     books_sorts: int
     available_books: int
     borrowed_books: int
 
 @app.post("/stats", response_model=SystemStats)
-async def get_system_stats():
-    books = book_service.book_repo.data.values()
-    return {
-        "books_sorts": len(books),
-        "available_books": sum(b["available"] for b in books),
-        "borrowed_books": sum(b["total"] - b["available"] for b in books)
-    }
+async def get_system_stats(http_request: Request):
+    def compute():
+        books = book_service.book_repo.data.values()
+        return {
+            "books_sorts": len(books),
+            "available_books": sum(b["available"] for b in books),
+            "borrowed_books": sum(b["total"] - b["available"] for b in books)
+        }
+    return cached_response(http_request, ("stats",), [book_service.book_repo], compute)
 
 @app.post("/del_books/{book_id}")
 async def delete_book(book_id: str):
@@ -484,6 +1112,7 @@ async def delete_book(book_id: str):
     raise HTTPException(404, "Book not found")
 
 temp_scan_data: Dict[str, Dict] = {}
+metrics.cache_entries.set_function(lambda: len(temp_scan_data), cache="scan_sessions")
 @app.post("/scan_book")
 async def scan_book_page(
     file: UploadFile = File(..., description="图书照片"),
@@ -547,10 +1176,10 @@ async def scan_book_page(
 @app.post("/finalize_book")
 async def create_book_from_scan(metadata: dict):
     try:
-        # 验证必要字段
+        # 验证必要字段（条码识别不提供作者，需用户补填，空值同样视为缺失）
         required_fields = ["title", "author", "isbn"]
-        if any(f not in metadata for f in required_fields):
-            missing = [f for f in required_fields if f not in metadata]
+        missing = [f for f in required_fields if not metadata.get(f)]
+        if missing:
             raise HTTPException(400, f"缺少必要字段: {missing}")
         
         # 创建正式记录
@@ -558,12 +1187,12 @@ async def create_book_from_scan(metadata: dict):
             "title": metadata["title"],
             "author": metadata["author"],
             "total": metadata.get("total", 1),
-            "isbn": metadata["isbn"],
+            "isbn": BookService.normalize_isbn(metadata["isbn"]),
             "price": metadata.get("price", 0.0)
         }
         
         # 验证ISBN格式
-        if not BookService._validate_isbn(book_data["isbn"]):
+        if not BookService._validate_isbn(book_data["isbn"] or ""):
             raise HTTPException(400, "无效的ISBN号码")
         
         book_id = book_service.create_book(book_data)